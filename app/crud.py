@@ -2,9 +2,12 @@ from __future__ import annotations
 
 import datetime as dt
 import re
+import threading
+import time
+from typing import Any, Callable
 
-from sqlalchemy import and_, case, func, or_, select, update as sql_update
-from sqlalchemy.orm import Session
+from sqlalchemy import Row, and_, case, func, insert, or_, select, update as sql_update
+from sqlalchemy.orm import Session, defer
 
 from .models import (
     BedSize,
@@ -22,6 +25,7 @@ from .models import (
     FurnitureVariant,
     InventoryCategory,
     PoshishMaterial,
+    Revision,
     SofaItem,
     StockMovement,
     Transaction,
@@ -266,8 +270,10 @@ def create_transaction(
         is_deleted=False,
     )
     db.add(tx)
+    _bump_transactions_revision(db)
     db.commit()
     db.refresh(tx)
+    _filter_values.invalidate()
     return tx
 
 
@@ -275,6 +281,11 @@ def get_transaction(db: Session, tx_id: int) -> Transaction | None:
     return db.execute(select(Transaction).where(Transaction.id == tx_id)).scalar_one_or_none()
 
 
+def get_active_transaction(db: Session, tx_id: int) -> Transaction | None:
+    stmt = select(Transaction).where(Transaction.id == tx_id, Transaction.is_deleted.is_(False))
+    return db.execute(stmt).scalar_one_or_none()
+
+
 def update_transaction(
     db: Session,
     tx: Transaction,
@@ -303,8 +314,10 @@ def update_transaction(
     tx.assignment_id = assignment_id
     tx.reference = reference or None
     db.add(tx)
+    _bump_transactions_revision(db)
     db.commit()
     db.refresh(tx)
+    _filter_values.invalidate()
     return tx
 
 
@@ -315,10 +328,61 @@ def list_employees(db: Session, *, status: str | None = None) -> list[Employee]:
     return list(db.execute(stmt).scalars().all())
 
 
+class _TTLMemo:
+    # A single memoized value, reloaded once `ttl` seconds have passed or after invalidate().
+    def __init__(self, ttl: float) -> None:
+        self._ttl = ttl
+        self._value = None
+        self._expires = 0.0
+
+    def get(self, load: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        value = self._value
+        if value is not None and now < self._expires:
+            return value
+        value = load()
+        self._value = value
+        self._expires = now + self._ttl
+        return value
+
+    def invalidate(self) -> None:
+        self._value = None
+
+
+# Payment-form dropdown rows (id, full_name, category); cleared whenever an employee is written.
+_active_employee_choices = _TTLMemo(30.0)
+
+
+def list_active_employee_choices(db: Session) -> list:
+    stmt = (
+        select(Employee.id, Employee.full_name, Employee.category)
+        .where(Employee.status == "active")
+        .order_by(Employee.full_name.asc())
+    )
+    return _active_employee_choices.get(lambda: db.execute(stmt).all())
+
+
 def get_employee(db: Session, employee_id: int) -> Employee | None:
     return db.execute(select(Employee).where(Employee.id == employee_id)).scalar_one_or_none()
 
 
+def get_employee_image_version(db: Session, employee_id: int, *, kind: str) -> Row | None:
+    # Enough to validate a cached image (or 404 a missing one) without reading the image TEXT.
+    has_image = Employee.has_cnic_image if kind == "cnic" else Employee.has_profile_image
+    return db.execute(select(Employee.updated_at, has_image).where(Employee.id == employee_id)).first()
+
+
+def get_employee_image_data(db: Session, employee_id: int, *, kind: str) -> str | None:
+    column = Employee.cnic_image_data if kind == "cnic" else Employee.profile_image_data
+    return db.execute(select(column).where(Employee.id == employee_id)).scalar_one_or_none()
+
+
+def get_employee_ref(db: Session, employee_id: int) -> Row | None:
+    # Just what payment handlers need (category mapping + default name); skips the image TEXT columns.
+    stmt = select(Employee.id, Employee.full_name, Employee.category).where(Employee.id == employee_id)
+    return db.execute(stmt).one_or_none()
+
+
 def create_employee(
     db: Session,
     *,
@@ -335,6 +399,7 @@ def create_employee(
     role_description: str | None,
     payment_rate: int | None,
     profile_image_url: str,
+    cnic_image_url: str | None = None,
 ) -> Employee:
     emp = Employee(
         full_name=full_name,
@@ -350,10 +415,12 @@ def create_employee(
         role_description=role_description or None,
         payment_rate=payment_rate,
         profile_image_url=profile_image_url or None,
+        cnic_image_url=cnic_image_url or None,
     )
     db.add(emp)
     db.commit()
     db.refresh(emp)
+    _active_employee_choices.invalidate()
     return emp
 
 
@@ -374,6 +441,8 @@ def update_employee(
     role_description: str | None,
     payment_rate: int | None,
     profile_image_url: str,
+    profile_image_upload_url: str | None = None,
+    cnic_image_upload_url: str | None = None,
 ) -> Employee:
     emp.full_name = full_name
     emp.father_name = father_name or None
@@ -388,9 +457,17 @@ def update_employee(
     emp.role_description = role_description or None
     emp.payment_rate = payment_rate
     emp.profile_image_url = profile_image_url or None
+    # A freshly uploaded image replaces both the URL and any legacy inline data.
+    if profile_image_upload_url:
+        emp.profile_image_url = profile_image_upload_url
+        emp.profile_image_data = None
+    if cnic_image_upload_url:
+        emp.cnic_image_url = cnic_image_upload_url
+        emp.cnic_image_data = None
     db.add(emp)
     db.commit()
     db.refresh(emp)
+    _active_employee_choices.invalidate()
     return emp
 
 
@@ -429,7 +506,7 @@ def create_assignment(
     return a
 
 
-def employee_transactions(db: Session, *, employee_id: int, limit: int = 500) -> list[Transaction]:
+def employee_ledger(db: Session, *, employee_id: int, limit: int = 500) -> list:
     emp = get_employee(db, employee_id)
     if not emp:
         return []
@@ -440,15 +517,35 @@ def employee_transactions(db: Session, *, employee_id: int, limit: int = 500) ->
         func.lower(func.trim(Transaction.name)) == func.lower(func.trim(emp.full_name)),
     )
 
+    debit = case((Transaction.employee_tx_type == "advance", Transaction.amount_pkr), else_=0)
+    credit = case(
+        (
+            or_(
+                Transaction.employee_tx_type.in_(["salary", "per_work"]),
+                Transaction.employee_tx_type.is_(None),
+            ),
+            Transaction.amount_pkr,
+        ),
+        else_=0,
+    )
+    # Running advance balance computed by the database; rows come back oldest first.
+    balance = func.sum(debit - credit).over(order_by=(Transaction.date.asc(), Transaction.id.asc()))
+
     stmt = (
-        select(Transaction)
+        select(
+            Transaction.date,
+            Transaction.employee_tx_type,
+            debit.label("debit"),
+            credit.label("credit"),
+            balance.label("balance"),
+        )
         .where(Transaction.is_deleted.is_(False))
         .where(Transaction.type == "outgoing")
         .where(or_(Transaction.employee_id == employee_id, legacy_name_clause))
         .order_by(Transaction.date.asc(), Transaction.id.asc())
         .limit(limit)
     )
-    return list(db.execute(stmt).scalars().all())
+    return db.execute(stmt).all()
 
 
 def employee_financial_summary(db: Session, *, employee_id: int) -> dict[str, int]:
@@ -500,7 +597,9 @@ def employee_financial_summary(db: Session, *, employee_id: int) -> dict[str, in
 def soft_delete_transaction(db: Session, tx: Transaction) -> None:
     tx.is_deleted = True
     db.add(tx)
+    _bump_transactions_revision(db)
     db.commit()
+    _filter_values.invalidate()
 
 
 def build_filters(
@@ -555,6 +654,7 @@ def list_transactions(
     name: str | None,
     q: str | None,
     limit: int = 500,
+    with_notes: bool = True,
 ):
     where_clause = build_filters(
         from_date=from_date,
@@ -568,11 +668,100 @@ def list_transactions(
     stmt = select(Transaction).order_by(Transaction.date.desc(), Transaction.id.desc())
     if where_clause is not None:
         stmt = stmt.where(where_clause)
+    # Listings never show `reference`; callers that don't print notes can skip that TEXT column too.
+    stmt = stmt.options(defer(Transaction.reference))
+    if not with_notes:
+        stmt = stmt.options(defer(Transaction.notes))
     stmt = stmt.limit(limit)
 
     return list(db.execute(stmt).scalars().all())
 
 
+def iter_transaction_export_rows(
+    db: Session,
+    *,
+    from_date: dt.date | None,
+    to_date: dt.date | None,
+    type: str | None,
+    category: str | None,
+    name: str | None,
+    q: str | None,
+):
+    # Plain tuples fetched in batches, so a full export never holds every row (or ORM object) at once.
+    where_clause = build_filters(from_date=from_date, to_date=to_date, type=type, category=category, name=name, q=q)
+    stmt = select(
+        Transaction.id,
+        Transaction.date,
+        Transaction.type,
+        Transaction.category,
+        Transaction.name,
+        Transaction.bill_no,
+        Transaction.amount_pkr,
+        Transaction.notes,
+    ).order_by(Transaction.date.desc(), Transaction.id.desc())
+    if where_clause is not None:
+        stmt = stmt.where(where_clause)
+    return db.execute(stmt.execution_options(yield_per=1000))
+
+
+def daily_totals(
+    db: Session,
+    *,
+    from_date: dt.date | None,
+    to_date: dt.date | None,
+    type: str | None,
+    category: str | None,
+    name: str | None,
+    q: str | None,
+) -> list[tuple[dt.date, int, int]]:
+    where_clause = build_filters(
+        from_date=from_date,
+        to_date=to_date,
+        type=type,
+        category=category,
+        name=name,
+        q=q,
+    )
+
+    stmt = select(
+        Transaction.date,
+        func.coalesce(func.sum(case((Transaction.type == "incoming", Transaction.amount_pkr), else_=0)), 0).label("incoming"),
+        func.coalesce(func.sum(case((Transaction.type == "outgoing", Transaction.amount_pkr), else_=0)), 0).label("outgoing"),
+    )
+    if where_clause is not None:
+        stmt = stmt.where(where_clause)
+    stmt = stmt.group_by(Transaction.date).order_by(Transaction.date.asc())
+
+    return [(r.date, int(r.incoming or 0), int(r.outgoing or 0)) for r in db.execute(stmt).all()]
+
+
+def outgoing_by_category(
+    db: Session,
+    *,
+    from_date: dt.date | None,
+    to_date: dt.date | None,
+    type: str | None,
+    category: str | None,
+    name: str | None,
+    q: str | None,
+) -> dict[str, int]:
+    where_clause = build_filters(
+        from_date=from_date,
+        to_date=to_date,
+        type=type,
+        category=category,
+        name=name,
+        q=q,
+    )
+
+    stmt = select(Transaction.category, func.sum(Transaction.amount_pkr).label("amount")).where(Transaction.type == "outgoing")
+    if where_clause is not None:
+        stmt = stmt.where(where_clause)
+    stmt = stmt.group_by(Transaction.category)
+
+    return {r.category: int(r.amount or 0) for r in db.execute(stmt).all()}
+
+
 def totals(db: Session, *, from_date: dt.date | None, to_date: dt.date | None, type: str | None, category: str | None, name: str | None, q: str | None):
     where_clause = build_filters(
         from_date=from_date,
@@ -602,6 +791,84 @@ def totals(db: Session, *, from_date: dt.date | None, to_date: dt.date | None, t
     return incoming, outgoing, incoming - outgoing
 
 
+def dashboard_totals(db: Session, *, today: dt.date, week_start: dt.date, week_end: dt.date) -> dict[str, int]:
+    # Today and the Sat-Thu week in one scan (on Fridays today falls just outside the week).
+    in_today = Transaction.date == today
+    in_week = Transaction.date.between(week_start, week_end)
+    is_incoming = Transaction.type == "incoming"
+    is_outgoing = Transaction.type == "outgoing"
+
+    def _sum(*conds):
+        return func.coalesce(func.sum(case((and_(*conds), Transaction.amount_pkr), else_=0)), 0)
+
+    where_clause = build_filters(
+        from_date=min(today, week_start),
+        to_date=max(today, week_end),
+        type=None,
+        category=None,
+        name=None,
+        q=None,
+    )
+    stmt = select(
+        _sum(in_today, is_incoming).label("today_incoming"),
+        _sum(in_today, is_outgoing).label("today_outgoing"),
+        _sum(in_week, is_incoming).label("week_incoming"),
+        _sum(in_week, is_outgoing).label("week_outgoing"),
+    ).where(where_clause)
+    row = db.execute(stmt).one()
+    return {k: int(v or 0) for k, v in row._mapping.items()}
+
+
+_TRANSACTIONS_REVISION = "transactions"
+# None until the first check; the table is created on demand so deployments without AUTO_CREATE_DB still get it.
+_revisions_state: dict = {"ready": None}
+_revisions_lock = threading.Lock()
+
+
+def ensure_revisions(bind) -> bool:
+    ready = _revisions_state["ready"]
+    if ready is not None:
+        return ready
+    with _revisions_lock:
+        if _revisions_state["ready"] is None:
+            # Own connection, so a failure here can never poison the caller's session transaction.
+            try:
+                with bind.begin() as conn:
+                    Revision.__table__.create(conn, checkfirst=True)
+                    if conn.execute(select(Revision.name).where(Revision.name == _TRANSACTIONS_REVISION)).first() is None:
+                        conn.execute(insert(Revision).values(name=_TRANSACTIONS_REVISION, value=0))
+            except Exception:
+                pass
+            # Another worker may have won the create/seed race; all that matters is that the row exists now.
+            try:
+                with bind.connect() as conn:
+                    row = conn.execute(select(Revision.name).where(Revision.name == _TRANSACTIONS_REVISION)).first()
+                _revisions_state["ready"] = row is not None
+            except Exception:
+                _revisions_state["ready"] = False
+    return _revisions_state["ready"]
+
+
+def _bump_transactions_revision(db: Session) -> None:
+    # Runs inside the writer's own commit, so the counter can never lag behind the row change.
+    if ensure_revisions(db.get_bind()):
+        db.execute(sql_update(Revision).where(Revision.name == _TRANSACTIONS_REVISION).values(value=Revision.value + 1))
+
+
+def transactions_version(db: Session) -> str | None:
+    # Every create/update/soft delete bumps the revision; MAX(id) also changes if the database is recreated.
+    # Both are single index probes. None means there is no counter to trust, so callers skip ETags and caching.
+    if not ensure_revisions(db.get_bind()):
+        return None
+    row = db.execute(
+        select(
+            select(Revision.value).where(Revision.name == _TRANSACTIONS_REVISION).scalar_subquery(),
+            select(func.max(Transaction.id)).scalar_subquery(),
+        )
+    ).one()
+    return f"{row[0] or 0}:{row[1] or 0}"
+
+
 def distinct_names(db: Session, *, limit: int = 200) -> list[str]:
     stmt = (
         select(func.min(Transaction.name))
@@ -630,6 +897,14 @@ def distinct_categories(db: Session, *, limit: int = 200) -> list[str]:
     return [r[0] for r in rows if r[0]]
 
 
+# Filter dropdown suggestions (names, categories); cleared whenever a transaction is written.
+_filter_values = _TTLMemo(60.0)
+
+
+def distinct_filter_values(db: Session) -> tuple[list[str], list[str]]:
+    return _filter_values.get(lambda: (distinct_names(db, limit=200), distinct_categories(db, limit=200)))
+
+
 def ensure_inventory_seed(db: Session) -> None:
     furniture_root = _upsert_category(db, type="FURNITURE", parent_id=None, name="Furniture")
     foam_root = _upsert_category(db, type="FOAM", parent_id=None, name="Foam")
@@ -4,10 +4,12 @@ import os
 import socket
 from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 IS_VERCEL = os.getenv("VERCEL") is not None
+# Deployed builds never change templates in place; local runs (run.sh) expect edits to show up live.
+IS_PRODUCTION = IS_VERCEL or os.getenv("ENV", "").strip().lower() in {"prod", "production"}
 
 DEFAULT_SQLITE_URL = "sqlite:////tmp/data.sqlite3" if IS_VERCEL else "sqlite:///./data.sqlite3"
 DB_URL = os.getenv("DATABASE_URL", DEFAULT_SQLITE_URL).strip()
@@ -27,7 +29,8 @@ if (DB_URL.startswith("postgresql://") or DB_URL.startswith("postgresql+")) and
 if DB_URL.startswith("postgresql://"):
     DB_URL = DB_URL.replace("postgresql://", "postgresql+psycopg://", 1)
 
-engine_kwargs: dict = {"pool_pre_ping": True}
+# The app issues many distinct filter/aggregate statement shapes; keep all of their compiled forms cached.
+engine_kwargs: dict = {"pool_pre_ping": True, "query_cache_size": 1200}
 if IS_SQLITE:
     engine_kwargs["connect_args"] = {"check_same_thread": False}
 elif IS_VERCEL and "supabase.co" in DB_URL:
@@ -46,4 +49,15 @@ engine = create_engine(DB_URL, **engine_kwargs)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# SQL_TRACE=1 records every statement a session runs (lazy loads included) in session.info["queries"],
+# so per-request query counts can be checked for N+1 regressions.
+SQL_TRACE = os.getenv("SQL_TRACE", "").strip() == "1"
+SQL_TRACE_MAX_QUERIES = int(os.getenv("SQL_TRACE_MAX_QUERIES", "8"))
+
+if SQL_TRACE:
+
+    @event.listens_for(SessionLocal, "do_orm_execute")
+    def _trace_orm_execute(orm_execute_state) -> None:
+        orm_execute_state.session.info.setdefault("queries", []).append(str(orm_execute_state.statement))
+
 Base = declarative_base()
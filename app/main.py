@@ -2,19 +2,30 @@ from __future__ import annotations
 
 import csv
 import datetime as dt
+import hashlib
+import heapq
 import io
+import logging
 import os
+import re
 import base64
-from typing import TYPE_CHECKING
-
-if TYPE_CHECKING:
-    import pandas as pd
+import binascii
+import secrets
+import threading
+from functools import lru_cache
+from operator import itemgetter
+from pathlib import Path
+from typing import Any
+
+import jinja2
+import orjson
 from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from starlette.middleware.base import BaseHTTPMiddleware
+from markupsafe import Markup
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
@@ -26,19 +37,30 @@ from reportlab.graphics.charts.barcharts import VerticalBarChart
 from reportlab.graphics.charts.linecharts import HorizontalLineChart
 from reportlab.graphics.charts.piecharts import Pie
 from reportlab.graphics.charts.legends import Legend
-from sqlalchemy import inspect, select, text
+from sqlalchemy import Row, func, inspect, select, text
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
 
 from . import crud
-from .db import Base, IS_SQLITE, SessionLocal, engine
+from .db import Base, IS_PRODUCTION, IS_SQLITE, SQL_TRACE, SQL_TRACE_MAX_QUERIES, SessionLocal, engine
 from .models import BedSize, Employee, FoamBrand, FoamModel, FoamThickness, FoamVariant, FurnitureItem, FurnitureVariant, InventoryCategory, Transaction, WeeklyAssignment
 from .utils import (
+    ALL_CATEGORIES,
+    ASSIGNMENT_STATUSES,
+    ChartSeries,
     EMPLOYEE_CATEGORIES,
+    EMPLOYEE_CATEGORY_SET,
+    EMPLOYEE_STATUSES,
+    EMPLOYEE_WORK_TYPE_SET,
     EMPLOYEE_WORK_TYPES,
     EMPLOYEE_TX_TYPES,
     INCOMING_CATEGORIES,
+    INCOMING_CATEGORY_SET,
     OUTGOING_CATEGORIES,
+    OUTGOING_CATEGORY_SET,
     PAYMENT_METHODS,
+    TX_TYPES,
+    build_series,
     clamp_date_range,
     parse_date,
     pkr_format,
@@ -46,6 +68,15 @@ from .utils import (
 )
 
 
+logger = logging.getLogger(__name__)
+if SQL_TRACE:
+    # uvicorn only configures its own loggers; without a handler here the per-request counts would be dropped.
+    _trace_handler = logging.StreamHandler()
+    _trace_handler.setFormatter(logging.Formatter("%(levelname)s:     [sql-trace] %(message)s"))
+    logger.addHandler(_trace_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
 MAX_IMAGE_UPLOAD_BYTES = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", "800000"))
 
 _EMPLOYEE_BACKFILL_RAN = False
@@ -58,18 +89,55 @@ if _CLOUDINARY_URL:
     cloudinary.config(cloudinary_url=_CLOUDINARY_URL)
 
 
+_DATA_URL_RE = re.compile(r"data:([^;,]*)[^,]*,(.*)", re.DOTALL)
+
+
 def _decode_data_url(data_url: str) -> tuple[str, bytes] | None:
     if not data_url:
         return None
-    if not data_url.startswith("data:"):
+    m = _DATA_URL_RE.match(data_url)
+    if not m:
         return None
     try:
-        header, b64 = data_url.split(",", 1)
-        content_type = header.split(":", 1)[1].split(";", 1)[0] or "application/octet-stream"
-        raw = base64.b64decode(b64)
-        return content_type, raw
-    except Exception:
+        raw = binascii.a2b_base64(m.group(2))
+    except (binascii.Error, ValueError):
         return None
+    return m.group(1) or "application/octet-stream", raw
+
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def _read_upload(upload: UploadFile) -> bytes:
+    # One byte past the cap is enough to detect an oversized file without reading all of it.
+    return upload.file.read(MAX_IMAGE_UPLOAD_BYTES + 1)
+
+
+def _sniff_image_type(raw: bytes) -> str | None:
+    for signature, content_type in _IMAGE_SIGNATURES:
+        if raw.startswith(signature):
+            return content_type
+    if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _validated_image(upload: UploadFile | None, label: str) -> tuple[bytes | None, str | None]:
+    if upload is None:
+        return None, None
+    raw = _read_upload(upload)
+    if not raw:
+        return None, None
+    if len(raw) > MAX_IMAGE_UPLOAD_BYTES:
+        return None, f"{label} image is too large. Max {MAX_IMAGE_UPLOAD_BYTES // 1000}KB."
+    if not _sniff_image_type(raw):
+        return None, f"{label} image must be a PNG, JPEG, GIF or WebP file."
+    return raw, None
 
 
 def _upload_image_to_cloudinary(*, raw: bytes, folder: str, public_id: str) -> str:
@@ -91,7 +159,8 @@ def _upload_image_to_cloudinary(*, raw: bytes, folder: str, public_id: str) -> s
         raise HTTPException(status_code=500, detail="Image upload failed")
 
 
-def _employee_outgoing_category(emp: Employee) -> str:
+def _employee_outgoing_category(emp: Employee | Row) -> str:
+    # Accepts a full Employee or the narrow (id, full_name, category) row from crud.get_employee_ref.
     c = (emp.category or "").lower()
     if "karkhan" in c or "factory" in c:
         return "Karkhanay Wala"
@@ -106,127 +175,215 @@ app = FastAPI(title="Nusrat Furniture Payments")
 SESSION_SECRET = os.getenv("SESSION_SECRET", "dev-secret")
 ADMIN_USER = os.getenv("ADMIN_USER", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin")
+_ADMIN_USER_BYTES = ADMIN_USER.encode("utf-8")
+_ADMIN_PASSWORD_BYTES = ADMIN_PASSWORD.encode("utf-8")
+
+_PUBLIC_PATHS = frozenset({"/login", "/logout"})
+_PUBLIC_PREFIXES = ("/static/",)
+
+
+class AuthMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        if path in _PUBLIC_PATHS or path.startswith(_PUBLIC_PREFIXES) or scope.get("session", {}).get("user"):
+            await self.app(scope, receive, send)
+            return
+        # Fresh message per response: SessionMiddleware appends Set-Cookie to these headers in place.
+        await send({"type": "http.response.start", "status": 303, "headers": [(b"location", b"/login"), (b"content-length", b"0")]})
+        await send({"type": "http.response.body", "body": b""})
+
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        if path.startswith("/static"):
-            return await call_next(request)
-        if path in {"/login", "/logout"}:
-            return await call_next(request)
-        if not _is_logged_in(request):
-            return RedirectResponse(url="/login", status_code=303)
-        return await call_next(request)
+class _SessionMiddleware(SessionMiddleware):
+    # Static assets never read the session; skip the cookie unsign and the re-signed Set-Cookie on each one.
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(_PUBLIC_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
-# Order matters: SessionMiddleware must run BEFORE auth so request.session works.
+# Order matters: SessionMiddleware must run BEFORE auth so scope["session"] is populated.
 app.add_middleware(AuthMiddleware)
 app.add_middleware(
-    SessionMiddleware,
+    _SessionMiddleware,
     secret_key=SESSION_SECRET,
     same_site="lax",
     https_only=os.getenv("VERCEL") is not None,
 )
 
-BASE_DIR = __import__("pathlib").Path(__file__).resolve().parent
-TEMPLATES = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# __file__ is already absolute, so resolve() would only add filesystem calls at import.
+BASE_DIR = Path(__file__).parent
+_TEMPLATES_DIR = str(BASE_DIR / "templates")
+_STATIC_DIR = str(BASE_DIR / "static")
+
+
+def _deploy_token() -> str:
+    # Changes whenever the code or templates do, so a deploy never revalidates against pre-deploy ETags.
+    sha = os.getenv("VERCEL_GIT_COMMIT_SHA")
+    if sha:
+        return sha
+    h = hashlib.blake2b(digest_size=8)
+    for path in sorted([*BASE_DIR.glob("*.py"), *BASE_DIR.glob("templates/*.html")]):
+        h.update(path.name.encode("utf-8"))
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+# Locally, templates can change under a running server, so the token is recomputed per request there.
+_DEPLOY_TOKEN = _deploy_token() if IS_PRODUCTION else None
+# In production templates only change on deploy: never stat them for changes and never evict compiled ones.
+# The bytecode cache (in the temp dir, writable on Vercel too) lets a cold worker skip parsing.
+# Locally Jinja's defaults stay, since uvicorn --reload only watches .py files.
+_TEMPLATE_CACHE_OPTIONS = (
+    {"auto_reload": False, "cache_size": -1, "bytecode_cache": jinja2.FileSystemBytecodeCache()} if IS_PRODUCTION else {}
+)
+TEMPLATES = Jinja2Templates(
+    env=jinja2.Environment(
+        loader=jinja2.FileSystemLoader(_TEMPLATES_DIR),
+        autoescape=True,
+        **_TEMPLATE_CACHE_OPTIONS,
+    )
+)
 
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+app.mount("/static", StaticFiles(directory=_STATIC_DIR), name="static")
 
 
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
     try:
         yield db
     finally:
+        if SQL_TRACE:
+            _report_queries(request, db)
         db.close()
 
 
+def _report_queries(request: Request, db: Session) -> None:
+    queries = db.info.get("queries", [])
+    if len(queries) > SQL_TRACE_MAX_QUERIES:
+        logger.warning(
+            "%s %s issued %d queries (budget %d):\n%s",
+            request.method,
+            request.url.path,
+            len(queries),
+            SQL_TRACE_MAX_QUERIES,
+            "\n".join(queries),
+        )
+    else:
+        logger.info("%s %s issued %d queries", request.method, request.url.path, len(queries))
+
+
+_ALTER_STMTS = (
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS employee_id INTEGER",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS employee_tx_type VARCHAR(32)",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS payment_method VARCHAR(32)",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS assignment_id INTEGER",
+    "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS reference VARCHAR(256)",
+    "ALTER TABLE furniture_items ADD COLUMN IF NOT EXISTS image_url VARCHAR(512)",
+    "ALTER TABLE furniture_items ADD COLUMN IF NOT EXISTS image_data TEXT",
+    "ALTER TABLE employees ADD COLUMN IF NOT EXISTS profile_image_url VARCHAR(512)",
+    "ALTER TABLE employees ADD COLUMN IF NOT EXISTS cnic_image_url VARCHAR(512)",
+    "ALTER TABLE employees ADD COLUMN IF NOT EXISTS profile_image_data TEXT",
+    "ALTER TABLE employees ADD COLUMN IF NOT EXISTS cnic_image_data TEXT",
+)
+
+
+@app.on_event("startup")
+def preload_templates() -> None:
+    for name in TEMPLATES.env.list_templates(extensions=["html"]):
+        TEMPLATES.env.get_template(name)
+
+
 @app.on_event("startup")
 def on_startup() -> None:
     auto_create = os.getenv("AUTO_CREATE_DB")
     if IS_SQLITE or (auto_create is not None and auto_create.strip() == "1"):
         try:
-            Base.metadata.create_all(bind=engine)
+            # One catalog query instead of create_all's per-table existence checks on every cold start.
+            if not set(Base.metadata.tables).issubset(inspect(engine).get_table_names()):
+                Base.metadata.create_all(bind=engine)
         except Exception:
             return
 
         if not IS_SQLITE:
+            # Columns added after the first deploy; Postgres skips any that already exist.
             try:
-                insp = inspect(engine)
-                cols = {c["name"] for c in insp.get_columns("transactions")}
-
-                alter_stmts: list[str] = []
-                if "employee_id" not in cols:
-                    alter_stmts.append("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS employee_id INTEGER")
-                if "employee_tx_type" not in cols:
-                    alter_stmts.append("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS employee_tx_type VARCHAR(32)")
-                if "payment_method" not in cols:
-                    alter_stmts.append("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS payment_method VARCHAR(32)")
-                if "assignment_id" not in cols:
-                    alter_stmts.append("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS assignment_id INTEGER")
-                if "reference" not in cols:
-                    alter_stmts.append("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS reference VARCHAR(256)")
-
-                if alter_stmts:
-                    with engine.begin() as conn:
-                        for stmt in alter_stmts:
-                            conn.execute(text(stmt))
+                with engine.begin() as conn:
+                    for stmt in _ALTER_STMTS:
+                        conn.execute(text(stmt))
             except Exception:
                 pass
 
-            try:
-                furniture_cols = {c["name"] for c in insp.get_columns("furniture_items")}
-                furniture_alter: list[str] = []
-                if "image_url" not in furniture_cols:
-                    furniture_alter.append("ALTER TABLE furniture_items ADD COLUMN IF NOT EXISTS image_url VARCHAR(512)")
-                if "image_data" not in furniture_cols:
-                    furniture_alter.append("ALTER TABLE furniture_items ADD COLUMN IF NOT EXISTS image_data TEXT")
-                if furniture_alter:
-                    with engine.begin() as conn:
-                        for stmt in furniture_alter:
-                            conn.execute(text(stmt))
-            except Exception:
-                pass
+        # create_all only builds indexes alongside new tables; add them to tables that predate them.
+        try:
+            with engine.begin() as conn:
+                for ix in Transaction.__table__.indexes:
+                    conn.execute(CreateIndex(ix, if_not_exists=True))
+        except Exception:
+            pass
 
-            try:
-                emp_cols = {c["name"] for c in insp.get_columns("employees")}
-                emp_alter: list[str] = []
-                if "profile_image_url" not in emp_cols:
-                    emp_alter.append("ALTER TABLE employees ADD COLUMN IF NOT EXISTS profile_image_url VARCHAR(512)")
-                if "cnic_image_url" not in emp_cols:
-                    emp_alter.append("ALTER TABLE employees ADD COLUMN IF NOT EXISTS cnic_image_url VARCHAR(512)")
-                if "profile_image_data" not in emp_cols:
-                    emp_alter.append("ALTER TABLE employees ADD COLUMN IF NOT EXISTS profile_image_data TEXT")
-                if "cnic_image_data" not in emp_cols:
-                    emp_alter.append("ALTER TABLE employees ADD COLUMN IF NOT EXISTS cnic_image_data TEXT")
-                if emp_alter:
-                    with engine.begin() as conn:
-                        for stmt in emp_alter:
-                            conn.execute(text(stmt))
-            except Exception:
-                pass
+    # The revision counter backs report ETags and caches, so it is needed whether or not AUTO_CREATE_DB is set.
+    crud.ensure_revisions(engine)
 
 
 def _is_logged_in(request: Request) -> bool:
-    try:
-        return bool(request.session.get("user"))
-    except Exception:
+    return bool(request.scope.get("session", {}).get("user"))
+
+
+def _transactions_etag(db: Session, request: Request) -> str | None:
+    # Report pages are a pure function of the deployed code, the query string, today's date and the transactions table.
+    version = crud.transactions_version(db)
+    if version is None:
+        return None
+    key = f"{_DEPLOY_TOKEN or _deploy_token()}|{request.url.path}?{request.url.query}|{dt.date.today().isoformat()}|{version}"
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
         return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _not_modified(request: Request, etag: str | None) -> Response | None:
+    if etag is not None and _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=_revalidate_headers(etag))
+    return None
+
+
+def _revalidate_headers(etag: str | None) -> dict[str, str]:
+    if etag is None:
+        return {"Cache-Control": "private, no-cache"}
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+_STATIC_CTX = {
+    "incoming_categories": INCOMING_CATEGORIES,
+    "outgoing_categories": OUTGOING_CATEGORIES,
+    "employee_categories": EMPLOYEE_CATEGORIES,
+    "employee_work_types": EMPLOYEE_WORK_TYPES,
+    "employee_tx_types": EMPLOYEE_TX_TYPES,
+    "payment_methods": PAYMENT_METHODS,
+    "all_categories": ALL_CATEGORIES,
+    "pkr_format": pkr_format,
+}
 
 
 def common_context(request: Request):
     return {
+        **_STATIC_CTX,
         "request": request,
         "is_logged_in": _is_logged_in(request),
-        "incoming_categories": INCOMING_CATEGORIES,
-        "outgoing_categories": OUTGOING_CATEGORIES,
-        "employee_categories": EMPLOYEE_CATEGORIES,
-        "employee_work_types": EMPLOYEE_WORK_TYPES,
-        "employee_tx_types": EMPLOYEE_TX_TYPES,
-        "payment_methods": PAYMENT_METHODS,
-        "all_categories": sorted(set(INCOMING_CATEGORIES + OUTGOING_CATEGORIES)),
-        "pkr_format": pkr_format,
         "today": dt.date.today().isoformat(),
     }
 
@@ -522,14 +679,21 @@ def employee_new_post(
     errors: dict[str, str] = {}
     if not full_name.strip():
         errors["full_name"] = "Full name is required."
-    if category not in EMPLOYEE_CATEGORIES:
+    if category not in EMPLOYEE_CATEGORY_SET:
         errors["category"] = "Invalid category."
-    if work_type not in EMPLOYEE_WORK_TYPES:
+    if work_type not in EMPLOYEE_WORK_TYPE_SET:
         errors["work_type"] = "Invalid work type."
-    if status not in {"active", "inactive"}:
+    if status not in EMPLOYEE_STATUSES:
         errors["status"] = "Invalid status."
     if not profile_image and not (profile_image_url or "").strip():
         errors["profile_image_url"] = "Profile image is required."
+    # Validate both files before uploading either, so a bad second file doesn't leave an orphan upload behind.
+    profile_raw, profile_err = _validated_image(profile_image, "Profile")
+    cnic_raw, cnic_err = _validated_image(cnic_image, "CNIC")
+    if profile_err:
+        errors["profile_image_url"] = profile_err
+    if cnic_err:
+        errors["cnic_image"] = cnic_err
     if errors:
         ctx = common_context(request)
         ctx.update(
@@ -555,26 +719,13 @@ def employee_new_post(
         )
         return TEMPLATES.TemplateResponse("employee_form.html", ctx, status_code=400)
 
+    stamp = int(dt.datetime.utcnow().timestamp())
     profile_url = (profile_image_url or "").strip() or None
-    if profile_image is not None:
-        raw = profile_image.file.read()
-        if raw and len(raw) > MAX_IMAGE_UPLOAD_BYTES:
-            errors["profile_image_url"] = f"Profile image is too large. Max {MAX_IMAGE_UPLOAD_BYTES // 1000}KB."
-        elif raw:
-            profile_url = _upload_image_to_cloudinary(raw=raw, folder="nf_employees", public_id=f"profile_{int(dt.datetime.utcnow().timestamp())}")
-
+    if profile_raw:
+        profile_url = _upload_image_to_cloudinary(raw=profile_raw, folder="nf_employees", public_id=f"profile_{stamp}")
     cnic_url = None
-    if cnic_image is not None:
-        raw2 = cnic_image.file.read()
-        if raw2 and len(raw2) > MAX_IMAGE_UPLOAD_BYTES:
-            errors["cnic_image"] = f"CNIC image is too large. Max {MAX_IMAGE_UPLOAD_BYTES // 1000}KB."
-        elif raw2:
-            cnic_url = _upload_image_to_cloudinary(raw=raw2, folder="nf_employees", public_id=f"cnic_{int(dt.datetime.utcnow().timestamp())}")
-
-    if errors:
-        ctx = common_context(request)
-        ctx.update({"mode": "new", "emp": None, "errors": errors})
-        return TEMPLATES.TemplateResponse("employee_form.html", ctx, status_code=400)
+    if cnic_raw:
+        cnic_url = _upload_image_to_cloudinary(raw=cnic_raw, folder="nf_employees", public_id=f"cnic_{stamp}")
 
     emp = crud.create_employee(
         db,
@@ -591,11 +742,8 @@ def employee_new_post(
         role_description=role_description,
         payment_rate=payment_rate,
         profile_image_url=profile_url,
+        cnic_image_url=cnic_url,
     )
-    if cnic_url:
-        emp.cnic_image_url = cnic_url
-        db.add(emp)
-        db.commit()
     return RedirectResponse(url=f"/employees/{emp.id}", status_code=303)
 
 
@@ -605,52 +753,45 @@ def employee_profile(request: Request, employee_id: int, db: Session = Depends(g
     if not emp:
         raise HTTPException(status_code=404, detail="Not found")
 
-    txs = crud.employee_transactions(db, employee_id=employee_id, limit=1000)
+    ledger = crud.employee_ledger(db, employee_id=employee_id, limit=1000)
     summary = crud.employee_financial_summary(db, employee_id=employee_id)
     assignments = crud.list_assignments_for_employee(db, employee_id=employee_id)
 
-    ledger = []
-    running = 0
-    for txx in txs:
-        debit = 0
-        credit = 0
-        if (txx.employee_tx_type or "") == "advance":
-            debit = int(txx.amount_pkr)
-            running += debit
-        elif (txx.employee_tx_type or "") in {"salary", "per_work"} or txx.employee_tx_type is None:
-            credit = int(txx.amount_pkr)
-            running -= credit
-        ledger.append({"tx": txx, "debit": debit, "credit": credit, "balance": running})
-
     ctx = common_context(request)
     ctx.update({"emp": emp, "summary": summary, "ledger": ledger, "assignments": assignments})
     return TEMPLATES.TemplateResponse("employee_profile.html", ctx)
 
 
-@app.get("/employees/{employee_id}/profile-image")
-def employee_profile_image(employee_id: int, db: Session = Depends(get_db)):
-    emp = crud.get_employee(db, employee_id)
-    if not emp:
+def _employee_image_response(request: Request, db: Session, employee_id: int, kind: str) -> Response:
+    row = crud.get_employee_image_version(db, employee_id, kind=kind)
+    if row is None:
         raise HTTPException(status_code=404, detail="Not found")
-
-    decoded = _decode_data_url(emp.profile_image_data or "")
+    updated_at, has_image = row
+    if not has_image:
+        raise HTTPException(status_code=404, detail="No image")
+    # updated_at moves on every employee edit, so a revalidation is answered before the image is even loaded.
+    key = f"{employee_id}|{kind}|{updated_at.isoformat()}"
+    etag = '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=3600"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data_url = crud.get_employee_image_data(db, employee_id, kind=kind)
+    decoded = _decode_data_url(data_url) if data_url else None
     if not decoded:
         raise HTTPException(status_code=404, detail="No image")
     content_type, raw = decoded
-    return Response(content=raw, media_type=content_type)
+    return Response(content=raw, media_type=content_type, headers=headers)
 
 
-@app.get("/employees/{employee_id}/cnic-image")
-def employee_cnic_image(employee_id: int, db: Session = Depends(get_db)):
-    emp = crud.get_employee(db, employee_id)
-    if not emp:
-        raise HTTPException(status_code=404, detail="Not found")
+@app.get("/employees/{employee_id}/profile-image")
+def employee_profile_image(request: Request, employee_id: int, db: Session = Depends(get_db)):
+    return _employee_image_response(request, db, employee_id, "profile")
 
-    decoded = _decode_data_url(emp.cnic_image_data or "")
-    if not decoded:
-        raise HTTPException(status_code=404, detail="No image")
-    content_type, raw = decoded
-    return Response(content=raw, media_type=content_type)
+
+@app.get("/employees/{employee_id}/cnic-image")
+def employee_cnic_image(request: Request, employee_id: int, db: Session = Depends(get_db)):
+    return _employee_image_response(request, db, employee_id, "cnic")
 
 
 @app.get("/employees/{employee_id}/edit", response_class=HTMLResponse)
@@ -691,19 +832,32 @@ def employee_edit_post(
     errors: dict[str, str] = {}
     if not full_name.strip():
         errors["full_name"] = "Full name is required."
-    if category not in EMPLOYEE_CATEGORIES:
+    if category not in EMPLOYEE_CATEGORY_SET:
         errors["category"] = "Invalid category."
-    if work_type not in EMPLOYEE_WORK_TYPES:
+    if work_type not in EMPLOYEE_WORK_TYPE_SET:
         errors["work_type"] = "Invalid work type."
-    if status not in {"active", "inactive"}:
+    if status not in EMPLOYEE_STATUSES:
         errors["status"] = "Invalid status."
-    if not profile_image and not (profile_image_url or "").strip() and not (emp.profile_image_data or emp.profile_image_url):
+    if not profile_image and not (profile_image_url or "").strip() and not (emp.has_profile_image or emp.profile_image_url):
         errors["profile_image_url"] = "Profile image is required."
+    profile_raw, profile_err = _validated_image(profile_image, "Profile")
+    cnic_raw, cnic_err = _validated_image(cnic_image, "CNIC")
+    if profile_err:
+        errors["profile_image_url"] = profile_err
+    if cnic_err:
+        errors["cnic_image"] = cnic_err
     if errors:
         ctx = common_context(request)
         ctx.update({"mode": "edit", "emp": emp, "errors": errors})
         return TEMPLATES.TemplateResponse("employee_form.html", ctx, status_code=400)
 
+    profile_upload_url = None
+    cnic_upload_url = None
+    if profile_raw:
+        profile_upload_url = _upload_image_to_cloudinary(raw=profile_raw, folder="nf_employees", public_id=f"profile_{emp.id}")
+    if cnic_raw:
+        cnic_upload_url = _upload_image_to_cloudinary(raw=cnic_raw, folder="nf_employees", public_id=f"cnic_{emp.id}")
+
     crud.update_employee(
         db,
         emp,
@@ -720,29 +874,10 @@ def employee_edit_post(
         role_description=role_description,
         payment_rate=payment_rate,
         profile_image_url=(profile_image_url or "").strip(),
+        profile_image_upload_url=profile_upload_url,
+        cnic_image_upload_url=cnic_upload_url,
     )
 
-    if profile_image is not None:
-        raw = profile_image.file.read()
-        if raw and len(raw) > MAX_IMAGE_UPLOAD_BYTES:
-            errors["profile_image_url"] = f"Profile image is too large. Max {MAX_IMAGE_UPLOAD_BYTES // 1000}KB."
-        elif raw:
-            emp.profile_image_url = _upload_image_to_cloudinary(raw=raw, folder="nf_employees", public_id=f"profile_{emp.id}")
-            emp.profile_image_data = None
-    if cnic_image is not None:
-        raw2 = cnic_image.file.read()
-        if raw2 and len(raw2) > MAX_IMAGE_UPLOAD_BYTES:
-            errors["cnic_image"] = f"CNIC image is too large. Max {MAX_IMAGE_UPLOAD_BYTES // 1000}KB."
-        elif raw2:
-            emp.cnic_image_url = _upload_image_to_cloudinary(raw=raw2, folder="nf_employees", public_id=f"cnic_{emp.id}")
-            emp.cnic_image_data = None
-
-    if errors:
-        ctx = common_context(request)
-        ctx.update({"mode": "edit", "emp": emp, "errors": errors})
-        return TEMPLATES.TemplateResponse("employee_form.html", ctx, status_code=400)
-    db.add(emp)
-    db.commit()
     return RedirectResponse(url=f"/employees/{employee_id}", status_code=303)
 
 
@@ -761,15 +896,15 @@ def assignment_new(
         raise HTTPException(status_code=404, detail="Not found")
     ws = parse_date(week_start) or dt.date.today()
     we = parse_date(week_end) or ws
-    if status not in {"pending", "in_progress", "completed"}:
+    if status not in ASSIGNMENT_STATUSES:
         status = "pending"
     crud.create_assignment(db, employee_id=employee_id, week_start=ws, week_end=we, description=description, quantity=quantity, status=status)
     return RedirectResponse(url=f"/employees/{employee_id}", status_code=303)
 
 
 def filter_context(db: Session):
-    names = crud.distinct_names(db, limit=200)
-    categories = sorted(set(INCOMING_CATEGORIES + OUTGOING_CATEGORIES + crud.distinct_categories(db, limit=200)))
+    names, db_categories = crud.distinct_filter_values(db)
+    categories = sorted(set(ALL_CATEGORIES).union(db_categories))
     return {"suggested_names": names, "filter_categories": categories}
 
 
@@ -784,7 +919,9 @@ def login_page(request: Request):
 
 @app.post("/login")
 def login_submit(request: Request, username: str = Form(""), password: str = Form("")):
-    if username == ADMIN_USER and password == ADMIN_PASSWORD:
+    user_ok = secrets.compare_digest(username.encode("utf-8"), _ADMIN_USER_BYTES)
+    password_ok = secrets.compare_digest(password.encode("utf-8"), _ADMIN_PASSWORD_BYTES)
+    if user_ok and password_ok:
         request.session["user"] = username
         return RedirectResponse(url="/", status_code=303)
     ctx = common_context(request)
@@ -811,7 +948,7 @@ def _require_seed_token(token: str | None) -> None:
     expected = (os.getenv("SEED_TOKEN") or "").strip()
     if not expected:
         raise HTTPException(status_code=500, detail="SEED_TOKEN is not configured")
-    if (token or "").strip() != expected:
+    if not secrets.compare_digest((token or "").strip().encode("utf-8"), expected.encode("utf-8")):
         raise HTTPException(status_code=403, detail="Forbidden")
 
 
@@ -1155,12 +1292,14 @@ def home(request: Request):
 @app.get("/daily", response_class=HTMLResponse)
 def dashboard(request: Request, db: Session = Depends(get_db)):
     today = dt.date.today()
-    incoming, outgoing, net = crud.totals(db, from_date=today, to_date=today, type=None, category=None, name=None, q=None)
-
     week = sat_thu_week_range(today)
-    w_in, w_out, w_net = crud.totals(db, from_date=week.start, to_date=week.end, type=None, category=None, name=None, q=None)
+    sums = crud.dashboard_totals(db, today=today, week_start=week.start, week_end=week.end)
+    incoming, outgoing = sums["today_incoming"], sums["today_outgoing"]
+    w_in, w_out = sums["week_incoming"], sums["week_outgoing"]
+    net = incoming - outgoing
+    w_net = w_in - w_out
 
-    recent = crud.list_transactions(db, from_date=None, to_date=None, type=None, category=None, name=None, q=None, limit=10)
+    recent = crud.list_transactions(db, from_date=None, to_date=None, type=None, category=None, name=None, q=None, limit=10, with_notes=False)
 
     ctx = common_context(request)
     ctx.update(
@@ -1613,15 +1752,16 @@ def inventory_furniture_create(
     update_image = False
 
     if furniture_image is not None and furniture_image.filename:
-        raw = furniture_image.file.read(MAX_IMAGE_UPLOAD_BYTES + 1)
+        raw = _read_upload(furniture_image)
         if len(raw) > MAX_IMAGE_UPLOAD_BYTES:
             raise HTTPException(status_code=400, detail="Image too large")
+        content_type = _sniff_image_type(raw)
+        if not content_type:
+            raise HTTPException(status_code=400, detail="Unsupported image type")
         if _CLOUDINARY_URL:
             new_image_url = _upload_image_to_cloudinary(raw=raw, folder="nf-ratta/furniture", public_id=f"furniture-{int(dt.datetime.utcnow().timestamp())}")
         else:
-            content_type = furniture_image.content_type or "application/octet-stream"
-            b64 = base64.b64encode(raw).decode("utf-8")
-            new_image_data = f"data:{content_type};base64,{b64}"
+            new_image_data = f"data:{content_type};base64,{base64.b64encode(raw).decode('ascii')}"
         update_image = True
 
     if edit_item_id is not None:
@@ -1791,11 +1931,11 @@ def inventory_stock_adjust(
 
 @app.get("/add", response_class=HTMLResponse)
 def add_payment(request: Request, db: Session = Depends(get_db), type: str = "incoming"):
-    if type not in {"incoming", "outgoing"}:
+    if type not in TX_TYPES:
         type = "incoming"
 
     ctx = common_context(request)
-    employees = crud.list_employees(db, status="active") if type == "outgoing" else []
+    employees = crud.list_active_employee_choices(db) if type == "outgoing" else []
     ctx.update(
         {
             "mode": "create",
@@ -1811,20 +1951,20 @@ def add_payment(request: Request, db: Session = Depends(get_db), type: str = "in
 def validate_form(type: str, category: str, bill_no: str | None, amount_pkr: int):
     errors: dict[str, str] = {}
 
-    if type not in {"incoming", "outgoing"}:
+    if type not in TX_TYPES:
         errors["type"] = "Invalid type."
 
     if amount_pkr <= 0:
         errors["amount_pkr"] = "Amount must be greater than 0."
 
     if type == "incoming":
-        if category not in INCOMING_CATEGORIES:
+        if category not in INCOMING_CATEGORY_SET:
             errors["category"] = "Invalid incoming source."
         if category == "Client" and not (bill_no or "").strip():
             errors["bill_no"] = "Bill Number is required for Client payments."
 
     if type == "outgoing":
-        if category not in OUTGOING_CATEGORIES:
+        if category not in OUTGOING_CATEGORY_SET:
             errors["category"] = "Invalid outgoing category."
 
     return errors
@@ -1847,7 +1987,7 @@ def add_payment_post(
     reference: str | None = Form(None),
 ):
     parsed_date = parse_date(date)
-    if not parsed_date:
+    if not parsed_date and not (date or "").strip():
         parsed_date = dt.date.today()
 
     parsed_employee_id: int | None = None
@@ -1859,25 +1999,27 @@ def add_payment_post(
 
     emp = None
     if type == "outgoing" and parsed_employee_id:
-        emp = crud.get_employee(db, parsed_employee_id)
+        emp = crud.get_employee_ref(db, parsed_employee_id)
         if emp:
             category = _employee_outgoing_category(emp)
             if not (name or "").strip():
                 name = emp.full_name
 
     errors = validate_form(type, category, bill_no, amount_pkr)
+    if not parsed_date:
+        errors["date"] = "Invalid date."
     if type == "outgoing" and parsed_employee_id:
         if not emp:
             errors["employee_id"] = "Invalid employee."
     if errors:
         ctx = common_context(request)
-        employees = crud.list_employees(db, status="active") if type == "outgoing" else []
+        employees = crud.list_active_employee_choices(db) if type == "outgoing" else []
         ctx.update(
             {
                 "mode": "create",
                 "type": type,
                 "tx": {
-                    "date": parsed_date,
+                    "date": parsed_date or date,
                     "amount_pkr": amount_pkr,
                     "category": category,
                     "name": name,
@@ -1927,7 +2069,10 @@ def transactions(
     f, t = clamp_date_range(f, t)
 
     items = crud.list_transactions(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q, limit=500)
-    incoming, outgoing, net = crud.totals(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
+    if len(items) < 500:
+        incoming, outgoing, net = _totals_from_items(items)
+    else:
+        incoming, outgoing, net = crud.totals(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
 
     ctx = common_context(request)
     ctx.update(filter_context(db))
@@ -1951,12 +2096,12 @@ def transactions(
 
 @app.get("/edit/{tx_id}", response_class=HTMLResponse)
 def edit_payment(request: Request, tx_id: int, db: Session = Depends(get_db)):
-    tx = crud.get_transaction(db, tx_id)
-    if not tx or tx.is_deleted:
+    tx = crud.get_active_transaction(db, tx_id)
+    if not tx:
         raise HTTPException(status_code=404, detail="Not found")
 
     ctx = common_context(request)
-    employees = crud.list_employees(db, status="active") if tx.type == "outgoing" else []
+    employees = crud.list_active_employee_choices(db) if tx.type == "outgoing" else []
     ctx.update({"mode": "edit", "type": tx.type, "tx": tx, "errors": {}, "employees": employees})
     return TEMPLATES.TemplateResponse("payment_form.html", ctx)
 
@@ -1977,12 +2122,12 @@ def edit_payment_post(
     payment_method: str | None = Form(None),
     reference: str | None = Form(None),
 ):
-    tx = crud.get_transaction(db, tx_id)
-    if not tx or tx.is_deleted:
+    tx = crud.get_active_transaction(db, tx_id)
+    if not tx:
         raise HTTPException(status_code=404, detail="Not found")
 
     parsed_date = parse_date(date)
-    if not parsed_date:
+    if not parsed_date and not (date or "").strip():
         parsed_date = dt.date.today()
 
     parsed_employee_id: int | None = None
@@ -1994,19 +2139,21 @@ def edit_payment_post(
 
     emp = None
     if tx.type == "outgoing" and parsed_employee_id:
-        emp = crud.get_employee(db, parsed_employee_id)
+        emp = crud.get_employee_ref(db, parsed_employee_id)
         if emp:
             category = _employee_outgoing_category(emp)
             if not (name or "").strip():
                 name = emp.full_name
 
     errors = validate_form(tx.type, category, bill_no, int(amount_pkr))
+    if not parsed_date:
+        errors["date"] = "Invalid date."
     if tx.type == "outgoing" and parsed_employee_id:
         if not emp:
             errors["employee_id"] = "Invalid employee."
     if errors:
         ctx = common_context(request)
-        employees = crud.list_employees(db, status="active") if tx.type == "outgoing" else []
+        employees = crud.list_active_employee_choices(db) if tx.type == "outgoing" else []
         ctx.update(
             {
                 "mode": "edit",
@@ -2014,7 +2161,7 @@ def edit_payment_post(
                 "tx": {
                     "id": tx.id,
                     "type": tx.type,
-                    "date": parsed_date,
+                    "date": parsed_date or date,
                     "amount_pkr": amount_pkr,
                     "category": category,
                     "name": name,
@@ -2051,14 +2198,98 @@ def edit_payment_post(
 
 @app.post("/delete/{tx_id}")
 def delete_payment(tx_id: int, db: Session = Depends(get_db)):
-    tx = crud.get_transaction(db, tx_id)
-    if not tx or tx.is_deleted:
+    tx = crud.get_active_transaction(db, tx_id)
+    if not tx:
         raise HTTPException(status_code=404, detail="Not found")
 
     crud.soft_delete_transaction(db, tx)
     return RedirectResponse(url="/transactions", status_code=303)
 
 
+_EMPTY_CHART = {"labels": [], "incoming": [], "outgoing": [], "outgoing_by_cat": {}, "cumulative_net": []}
+
+
+def _chart_json(chart: dict) -> Markup:
+    # orjson output with the same escaping as Jinja's |tojson, so it is safe inside a <script> tag.
+    data = orjson.dumps(chart).decode("utf-8")
+    return Markup(data.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026").replace("'", "\\u0027"))
+
+
+def _totals_from_items(items) -> tuple[int, int, int]:
+    incoming = outgoing = 0
+    for txx in items:
+        if txx.type == "incoming":
+            incoming += txx.amount_pkr
+        elif txx.type == "outgoing":
+            outgoing += txx.amount_pkr
+    return incoming, outgoing, incoming - outgoing
+
+
+def _chart_payload(series: ChartSeries, outgoing_by_cat: dict[str, int]) -> dict:
+    return {
+        "labels": series.labels,
+        "incoming": series.incoming,
+        "outgoing": series.outgoing,
+        "outgoing_by_cat": outgoing_by_cat,
+        "cumulative_net": series.cumulative_net,
+    }
+
+
+class _ETagCache:
+    # Thread-safe dict keyed by ETag that drops its oldest entry past `maxsize`; a None ETag is never cached.
+    def __init__(self, maxsize: int) -> None:
+        self._maxsize = maxsize
+        self._entries: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, etag: str | None) -> Any:
+        if etag is None:
+            return None
+        with self._lock:
+            return self._entries.get(etag)
+
+    def put(self, etag: str | None, value: Any) -> None:
+        if etag is None:
+            return
+        with self._lock:
+            self._entries[etag] = value
+            while len(self._entries) > self._maxsize:
+                self._entries.pop(next(iter(self._entries)))
+
+
+# Keyed by the page ETag: query string, today's date and transactions_version. The version's revision
+# counter is bumped in the same commit as every create/update/soft delete, so no write can leave a stale entry.
+_AGGREGATE_CACHE = _ETagCache(128)
+
+
+def _report_aggregates(
+    db: Session,
+    etag: str | None,
+    *,
+    from_date: dt.date | None,
+    to_date: dt.date | None,
+    type: str | None,
+    category: str | None,
+    name: str | None,
+    q: str | None,
+) -> tuple[int, int, Markup]:
+    hit = _AGGREGATE_CACHE.get(etag)
+    if hit is not None:
+        return hit
+
+    days = crud.daily_totals(db, from_date=from_date, to_date=to_date, type=type, category=category, name=name, q=q)
+    if days:
+        outgoing_by_cat = crud.outgoing_by_category(db, from_date=from_date, to_date=to_date, type=type, category=category, name=name, q=q)
+        series = build_series(days)
+        result = (series.total_incoming, series.total_outgoing, _chart_json(_chart_payload(series, outgoing_by_cat)))
+    else:
+        result = (0, 0, _chart_json(_EMPTY_CHART))
+
+    _AGGREGATE_CACHE.put(etag, result)
+    return result
+
+
+@lru_cache(maxsize=512)
 def period_range(period: str, anchor: dt.date) -> tuple[dt.date, dt.date]:
     if period == "daily":
         return anchor, anchor
@@ -2090,36 +2321,18 @@ def reports(
     if period not in {"daily", "weekly", "monthly"}:
         period = "daily"
 
+    etag = _transactions_etag(db, request)
+    cached = _not_modified(request, etag)
+    if cached is not None:
+        return cached
+
     anchor_date = parse_date(anchor) or dt.date.today()
     start, end = period_range(period, anchor_date)
 
     items = crud.list_transactions(db, from_date=start, to_date=end, type=type, category=category, name=name, q=q, limit=2000)
-    incoming, outgoing, net = crud.totals(db, from_date=start, to_date=end, type=type, category=category, name=name, q=q)
-
-    by_day: dict[str, dict[str, int]] = {}
-    outgoing_by_cat: dict[str, int] = {}
-    for tx in items:
-        k = tx.date.isoformat()
-        by_day.setdefault(k, {"incoming": 0, "outgoing": 0})
-        by_day[k][tx.type] += int(tx.amount_pkr)
-        if tx.type == "outgoing":
-            outgoing_by_cat[tx.category] = outgoing_by_cat.get(tx.category, 0) + int(tx.amount_pkr)
-
-    labels = sorted(by_day.keys())
-    incoming_series = [by_day[d]["incoming"] for d in labels]
-    outgoing_series = [by_day[d]["outgoing"] for d in labels]
-
-    net_series = []
-    running = 0
-    for inc, out in zip(incoming_series, outgoing_series):
-        running += inc - out
-        net_series.append(running)
-
-    if len(labels) > 31:
-        labels = labels[-31:]
-        incoming_series = incoming_series[-31:]
-        outgoing_series = outgoing_series[-31:]
-        net_series = net_series[-31:]
+    incoming, outgoing, chart_json = _report_aggregates(
+        db, etag, from_date=start, to_date=end, type=type, category=category, name=name, q=q
+    )
 
     ctx = common_context(request)
     ctx.update(filter_context(db))
@@ -2131,46 +2344,19 @@ def reports(
             "end": end,
             "items": items,
             "filters": {"type": type or "", "category": category or "", "name": name or "", "q": q or ""},
-            "totals": {"incoming": incoming, "outgoing": outgoing, "net": net},
-            "chart": {
-                "labels": labels,
-                "incoming": incoming_series,
-                "outgoing": outgoing_series,
-                "outgoing_by_cat": outgoing_by_cat,
-                "cumulative_net": net_series,
-            },
+            "totals": {"incoming": incoming, "outgoing": outgoing, "net": incoming - outgoing},
+            "chart_json": chart_json,
         }
     )
 
-    return TEMPLATES.TemplateResponse("reports.html", ctx)
+    return TEMPLATES.TemplateResponse("reports.html", ctx, headers=_revalidate_headers(etag))
 
 
-def to_dataframe(items: list[Transaction]):
-    try:
-        import pandas as pd
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Export requires pandas. Install pandas or disable export. ({e})")
-
-    rows = []
-    for t in items:
-        rows.append(
-            {
-                "ID": t.id,
-                "Date": t.date.isoformat(),
-                "Type": t.type,
-                "Category": t.category,
-                "Name": t.name or "",
-                "Bill No": t.bill_no or "",
-                "Amount (PKR)": int(t.amount_pkr),
-                "Notes": t.notes or "",
-            }
-        )
-    return pd.DataFrame(rows)
+_EXPORT_COLUMNS = ["ID", "Date", "Type", "Category", "Name", "Bill No", "Amount (PKR)", "Notes"]
 
 
 @app.get("/export/xlsx")
 def export_xlsx(
-    request: Request,
     db: Session = Depends(get_db),
     from_date: str | None = None,
     to_date: str | None = None,
@@ -2179,110 +2365,116 @@ def export_xlsx(
     name: str | None = None,
     q: str | None = None,
 ):
-    params = {
-        "from_date": from_date or "",
-        "to_date": to_date or "",
-        "type": type or "",
-        "category": category or "",
-        "name": name or "",
-        "q": q or "",
-    }
-    from urllib.parse import urlencode
-
-    url = "/export/pdf?" + urlencode(params)
-    return RedirectResponse(url=url, status_code=303)
-
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export requires openpyxl. Install openpyxl or disable export. ({e})")
 
-@app.get("/export/pdf")
-def export_pdf(
-    db: Session = Depends(get_db),
-    from_date: str | None = None,
-    to_date: str | None = None,
-    type: str | None = None,
-    category: str | None = None,
-    name: str | None = None,
-    q: str | None = None,
-):
     f = parse_date(from_date)
     t = parse_date(to_date)
     f, t = clamp_date_range(f, t)
 
-    items = crud.list_transactions(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q, limit=3000)
-    incoming, outgoing, net = crud.totals(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
-
-    by_day: dict[str, dict[str, int]] = {}
-    outgoing_by_cat: dict[str, int] = {}
-    for tx in items:
-        k = tx.date.isoformat()
-        by_day.setdefault(k, {"incoming": 0, "outgoing": 0})
-        by_day[k][tx.type] += int(tx.amount_pkr)
-        if tx.type == "outgoing":
-            outgoing_by_cat[tx.category] = outgoing_by_cat.get(tx.category, 0) + int(tx.amount_pkr)
-
-    labels = sorted(by_day.keys())
-    incoming_series = [by_day[d]["incoming"] for d in labels]
-    outgoing_series = [by_day[d]["outgoing"] for d in labels]
-    cumulative_net = []
-    running = 0
-    for inc, out in zip(incoming_series, outgoing_series):
-        running += inc - out
-        cumulative_net.append(running)
-
-    chart_labels = labels[-14:] if len(labels) > 14 else labels
-    chart_incoming = incoming_series[-14:] if len(incoming_series) > 14 else incoming_series
-    chart_outgoing = outgoing_series[-14:] if len(outgoing_series) > 14 else outgoing_series
-    chart_cum_net = cumulative_net[-14:] if len(cumulative_net) > 14 else cumulative_net
+    # Pasted text can carry control characters (e.g. \x0b) that openpyxl refuses to write.
+    def clean(value: str | None) -> str:
+        return ILLEGAL_CHARACTERS_RE.sub("", value) if value else ""
+
+    # Write-only mode streams rows into the sheet XML instead of keeping a cell object per value.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Transactions")
+    ws.append(_EXPORT_COLUMNS)
+    for r in crud.iter_transaction_export_rows(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q):
+        ws.append((r.id, r.date.isoformat(), r.type, clean(r.category), clean(r.name), clean(r.bill_no), r.amount_pkr, clean(r.notes)))
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    return Response(
+        content=buf.getvalue(),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": "attachment; filename=transactions.xlsx"},
+    )
+
+
+_PDF_CHART_DAYS = 14
+_PDF_BLUE = colors.HexColor("#0d6efd")
+_PDF_GREEN = colors.HexColor("#198754")
+_PDF_RED = colors.HexColor("#dc3545")
+_PDF_BORDER = colors.HexColor("#cbd5e1")
+_PDF_STYLES = getSampleStyleSheet()
+_PDF_TITLE_STYLE = ParagraphStyle("nf_title", parent=_PDF_STYLES["Title"], alignment=TA_CENTER)
+_PDF_SMALL_STYLE = ParagraphStyle("nf_small", parent=_PDF_STYLES["Normal"], fontSize=9, textColor=colors.HexColor("#4b5563"))
+_PDF_HEADING_STYLE = _PDF_STYLES["Heading3"]
+_PDF_PALETTE = [
+    _PDF_BLUE,
+    _PDF_GREEN,
+    _PDF_RED,
+    colors.HexColor("#fd7e14"),
+    colors.HexColor("#6f42c1"),
+    colors.HexColor("#20c997"),
+    colors.HexColor("#0dcaf0"),
+]
+_PDF_KPI_TABLE_STYLE = TableStyle(
+    [
+        ("BACKGROUND", (0, 0), (-1, 0), _PDF_BLUE),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTNAME", (0, 1), (-1, 1), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 9),
+        ("FONTSIZE", (0, 1), (-1, 1), 12),
+        ("TOPPADDING", (0, 0), (-1, -1), 8),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 8),
+        ("BOX", (0, 0), (-1, -1), 0.5, _PDF_BORDER),
+    ]
+)
+_PDF_TX_TABLE_STYLE = TableStyle(
+    [
+        ("BACKGROUND", (0, 0), (-1, 0), _PDF_BLUE),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("GRID", (0, 0), (-1, -1), 0.25, _PDF_BORDER),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.whitesmoke, colors.HexColor("#f1f5f9")]),
+        ("ALIGN", (-1, 1), (-1, -1), "RIGHT"),
+    ]
+)
+
+_PDF_TABLE_HEADER = ["Date", "Type", "Category", "Name", "Bill", "Amount (PKR)"]
+
+# Rendered PDFs keyed by ETag, so identical exports skip ReportLab entirely; like _AGGREGATE_CACHE,
+# entries stop matching as soon as any transaction write bumps transactions_version.
+_PDF_CACHE = _ETagCache(16)
+
 
+def _render_pdf(*, period_txt: str, filters: list[str], series: ChartSeries, outgoing_by_cat: dict[str, int], rows: list[list[str]]) -> memoryview:
+    # Takes only plain values (no ORM rows or sessions), so it can run anywhere the data has been collected.
     buf = io.BytesIO()
     doc = SimpleDocTemplate(buf, pagesize=A4, title="Nusrat Furniture Report", leftMargin=1.2 * cm, rightMargin=1.2 * cm, topMargin=1.2 * cm, bottomMargin=1.2 * cm)
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle("nf_title", parent=styles["Title"], alignment=TA_CENTER)
-    small_style = ParagraphStyle("nf_small", parent=styles["Normal"], fontSize=9, textColor=colors.HexColor("#4b5563"))
 
-    period_txt = "All dates" if (not f and not t) else f"From {f.isoformat() if f else '...'} to {t.isoformat() if t else '...'}"
+    net = series.total_incoming - series.total_outgoing
 
     story: list[Flowable] = []
-    story.append(Paragraph("Nusrat Furniture — Dashboard Report", title_style))
+    story.append(Paragraph("Nusrat Furniture — Dashboard Report", _PDF_TITLE_STYLE))
     story.append(Spacer(1, 6))
-    story.append(Paragraph(period_txt, small_style))
-    applied = []
-    if type:
-        applied.append(f"Type={type}")
-    if category:
-        applied.append(f"Category={category}")
-    if name:
-        applied.append(f"Name={name}")
-    if q:
-        applied.append(f"Search={q}")
-    if applied:
+    story.append(Paragraph(period_txt, _PDF_SMALL_STYLE))
+    if filters:
         story.append(Spacer(1, 2))
-        story.append(Paragraph("Filters: " + ", ".join(applied), small_style))
+        story.append(Paragraph("Filters: " + ", ".join(filters), _PDF_SMALL_STYLE))
     story.append(Spacer(1, 10))
 
     kpi = Table(
-        [["Total Incoming", "Total Outgoing", "Net"], [pkr_format(incoming), pkr_format(outgoing), pkr_format(net)]],
+        [["Total Incoming", "Total Outgoing", "Net"], [pkr_format(series.total_incoming), pkr_format(series.total_outgoing), pkr_format(net)]],
         colWidths=[(A4[0] - 2.4 * cm) / 3.0] * 3,
     )
-    kpi.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0d6efd")),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTNAME", (0, 1), (-1, 1), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, 0), 9),
-                ("FONTSIZE", (0, 1), (-1, 1), 12),
-                ("TOPPADDING", (0, 0), (-1, -1), 8),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 8),
-                ("BOX", (0, 0), (-1, -1), 0.5, colors.HexColor("#cbd5e1")),
-            ]
-        )
-    )
+    kpi.setStyle(_PDF_KPI_TABLE_STYLE)
     story.append(kpi)
     story.append(Spacer(1, 10))
 
     chart_width = A4[0] - 2.4 * cm
+    chart_labels = series.labels
+    chart_incoming = series.incoming
+    chart_outgoing = series.outgoing
+    chart_cum_net = series.cumulative_net
 
     if chart_labels:
         bar_d = Drawing(chart_width, 170)
@@ -2296,10 +2488,10 @@ def export_pdf(
         bc.categoryAxis.labels.angle = 45
         bc.categoryAxis.labels.dy = -8
         bc.valueAxis.valueMin = 0
-        bc.bars[0].fillColor = colors.HexColor("#198754")
-        bc.bars[1].fillColor = colors.HexColor("#dc3545")
+        bc.bars[0].fillColor = _PDF_GREEN
+        bc.bars[1].fillColor = _PDF_RED
         bar_d.add(bc)
-        story.append(Paragraph("Incoming vs Outgoing (last days)", styles["Heading3"]))
+        story.append(Paragraph("Incoming vs Outgoing (last days)", _PDF_HEADING_STYLE))
         story.append(bar_d)
         story.append(Spacer(1, 8))
 
@@ -2313,9 +2505,9 @@ def export_pdf(
         lc.categoryAxis.categoryNames = chart_labels
         lc.categoryAxis.labels.angle = 45
         lc.categoryAxis.labels.dy = -8
-        lc.lines[0].strokeColor = colors.HexColor("#0d6efd")
+        lc.lines[0].strokeColor = _PDF_BLUE
         line_d.add(lc)
-        story.append(Paragraph("Cash Flow (cumulative net)", styles["Heading3"]))
+        story.append(Paragraph("Cash Flow (cumulative net)", _PDF_HEADING_STYLE))
         story.append(line_d)
         story.append(Spacer(1, 8))
 
@@ -2326,8 +2518,8 @@ def export_pdf(
         pie.y = 20
         pie.width = 160
         pie.height = 160
-        top = sorted(outgoing_by_cat.items(), key=lambda kv: kv[1], reverse=True)[:6]
-        other_sum = sum(v for _, v in sorted(outgoing_by_cat.items(), key=lambda kv: kv[1], reverse=True)[6:])
+        top = heapq.nlargest(6, outgoing_by_cat.items(), key=itemgetter(1))
+        other_sum = sum(outgoing_by_cat.values()) - sum(v for _, v in top)
         labels_pie = [k for k, _ in top]
         values_pie = [v for _, v in top]
         if other_sum > 0:
@@ -2335,18 +2527,9 @@ def export_pdf(
             values_pie.append(other_sum)
         pie.data = values_pie
         pie.labels = None
-
-        palette = [
-            colors.HexColor("#0d6efd"),
-            colors.HexColor("#198754"),
-            colors.HexColor("#dc3545"),
-            colors.HexColor("#fd7e14"),
-            colors.HexColor("#6f42c1"),
-            colors.HexColor("#20c997"),
-            colors.HexColor("#0dcaf0"),
-        ]
-        for i in range(len(values_pie)):
-            pie.slices[i].fillColor = palette[i % len(palette)]
+        slice_colors = [_PDF_PALETTE[i % len(_PDF_PALETTE)] for i in range(len(values_pie))]
+        for i, color in enumerate(slice_colors):
+            pie.slices[i].fillColor = color
 
         pie_d.add(pie)
 
@@ -2354,52 +2537,26 @@ def export_pdf(
         legend.x = 220
         legend.y = 170
         legend.alignment = "right"
-        legend.colorNamePairs = [(pie.slices[i].fillColor, labels_pie[i]) for i in range(len(labels_pie))]
+        legend.colorNamePairs = list(zip(slice_colors, labels_pie))
         pie_d.add(legend)
-        story.append(Paragraph("Expense Breakdown", styles["Heading3"]))
+        story.append(Paragraph("Expense Breakdown", _PDF_HEADING_STYLE))
         story.append(pie_d)
         story.append(Spacer(1, 10))
 
-    data = [["Date", "Type", "Category", "Name", "Bill", "Amount (PKR)"]]
-    for txx in items[:120]:
-        data.append(
-            [
-                txx.date.isoformat(),
-                txx.type,
-                txx.category,
-                (txx.name or "")[:20],
-                (txx.bill_no or "")[:12],
-                f"{int(txx.amount_pkr):,}",
-            ]
-        )
-
-    table = Table(data, repeatRows=1, colWidths=[2.0 * cm, 2.0 * cm, 4.2 * cm, 3.0 * cm, 2.2 * cm, 3.0 * cm])
-    table.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0d6efd")),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#cbd5e1")),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 8),
-                ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.whitesmoke, colors.HexColor("#f1f5f9")]),
-                ("ALIGN", (-1, 1), (-1, -1), "RIGHT"),
-            ]
-        )
-    )
+    table = Table([_PDF_TABLE_HEADER, *rows], repeatRows=1, colWidths=[2.0 * cm, 2.0 * cm, 4.2 * cm, 3.0 * cm, 2.2 * cm, 3.0 * cm])
+    table.setStyle(_PDF_TX_TABLE_STYLE)
 
-    story.append(Paragraph("Transactions (sample)", styles["Heading3"]))
+    story.append(Paragraph("Transactions (sample)", _PDF_HEADING_STYLE))
     story.append(table)
     doc.build(story)
 
-    buf.seek(0)
-    filename = "nusrat-furniture-report.pdf"
-    headers = {"Content-Disposition": f"attachment; filename={filename}"}
-    return Response(buf.getvalue(), media_type="application/pdf", headers=headers)
 
+    # View the BytesIO's own buffer rather than copying it out with getvalue().
+    return buf.getbuffer()
 
-@app.get("/analytics", response_class=HTMLResponse)
-def analytics(
+
+@app.get("/export/pdf")
+def export_pdf(
     request: Request,
     db: Session = Depends(get_db),
     from_date: str | None = None,
@@ -2413,29 +2570,64 @@ def analytics(
     t = parse_date(to_date)
     f, t = clamp_date_range(f, t)
 
-    items = crud.list_transactions(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q, limit=10000)
+    etag = _transactions_etag(db, request)
+    cached = _not_modified(request, etag)
+    if cached is not None:
+        return cached
 
-    by_day: dict[str, dict[str, int]] = {}
-    outgoing_by_cat: dict[str, int] = {}
+    filename = "nusrat-furniture-report.pdf"
+    headers = {"Content-Disposition": f"attachment; filename={filename}", **_revalidate_headers(etag)}
+    pdf = _PDF_CACHE.get(etag)
+    if pdf is not None:
+        return Response(pdf, media_type="application/pdf", headers=headers)
 
-    running_dates = sorted({tx.date for tx in items})
+    items = crud.list_transactions(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q, limit=120, with_notes=False)
+    days = crud.daily_totals(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
+    outgoing_by_cat = crud.outgoing_by_category(db, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
 
-    for tx in items:
-        k = tx.date.isoformat()
-        by_day.setdefault(k, {"incoming": 0, "outgoing": 0})
-        by_day[k][tx.type] += int(tx.amount_pkr)
-        if tx.type == "outgoing":
-            outgoing_by_cat[tx.category] = outgoing_by_cat.get(tx.category, 0) + int(tx.amount_pkr)
+    period_txt = "All dates" if (not f and not t) else f"From {f.isoformat() if f else '...'} to {t.isoformat() if t else '...'}"
 
-    labels = sorted(by_day.keys())
-    incoming_series = [by_day[d]["incoming"] for d in labels]
-    outgoing_series = [by_day[d]["outgoing"] for d in labels]
+    applied = []
+    if type:
+        applied.append(f"Type={type}")
+    if category:
+        applied.append(f"Category={category}")
+    if name:
+        applied.append(f"Name={name}")
+    if q:
+        applied.append(f"Search={q}")
+
+    rows = [
+        [txx.date.isoformat(), txx.type, txx.category, (txx.name or "")[:20], (txx.bill_no or "")[:12], f"{txx.amount_pkr:,}"]
+        for txx in items
+    ]
+
+    pdf = _render_pdf(period_txt=period_txt, filters=applied, series=build_series(days, window=_PDF_CHART_DAYS), outgoing_by_cat=outgoing_by_cat, rows=rows)
+    _PDF_CACHE.put(etag, pdf)
+    return Response(pdf, media_type="application/pdf", headers=headers)
+
+
+@app.get("/analytics", response_class=HTMLResponse)
+def analytics(
+    request: Request,
+    db: Session = Depends(get_db),
+    from_date: str | None = None,
+    to_date: str | None = None,
+    type: str | None = None,
+    category: str | None = None,
+    name: str | None = None,
+    q: str | None = None,
+):
+    f = parse_date(from_date)
+    t = parse_date(to_date)
+    f, t = clamp_date_range(f, t)
+
+    etag = _transactions_etag(db, request)
+    cached = _not_modified(request, etag)
+    if cached is not None:
+        return cached
 
-    net_series = []
-    running = 0
-    for inc, out in zip(incoming_series, outgoing_series):
-        running += inc - out
-        net_series.append(running)
+    _, _, chart_json = _report_aggregates(db, etag, from_date=f, to_date=t, type=type, category=category, name=name, q=q)
 
     ctx = common_context(request)
     ctx.update(filter_context(db))
@@ -2449,14 +2641,8 @@ def analytics(
                 "name": name or "",
                 "q": q or "",
             },
-            "chart": {
-                "labels": labels,
-                "incoming": incoming_series,
-                "outgoing": outgoing_series,
-                "outgoing_by_cat": outgoing_by_cat,
-                "cumulative_net": net_series,
-            },
+            "chart_json": chart_json,
         }
     )
 
-    return TEMPLATES.TemplateResponse("analytics.html", ctx)
+    return TEMPLATES.TemplateResponse("analytics.html", ctx, headers=_revalidate_headers(etag))
@@ -2,7 +2,8 @@ from __future__ import annotations
 
 import datetime as dt
 
-from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, String, Text
+from sqlalchemy.orm import column_property, deferred
 from sqlalchemy.sql import func
 
 from .db import Base
@@ -32,6 +33,11 @@ class Employee(Base):
     cnic_image_url = Column(String(512), nullable=True)
     profile_image_data = Column(Text, nullable=True)
     cnic_image_data = Column(Text, nullable=True)
+    # Legacy inline images can be hundreds of KB each; load them only when actually served.
+    has_profile_image = column_property(profile_image_data.is_not(None))
+    has_cnic_image = column_property(cnic_image_data.is_not(None))
+    profile_image_data = deferred(profile_image_data)
+    cnic_image_data = deferred(cnic_image_data)
 
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
@@ -144,6 +150,33 @@ class Transaction(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
+    # Partial indexes: every report query filters on is_deleted IS false, so soft-deleted rows stay out of them.
+    __table_args__ = (
+        Index(
+            "ix_tx_live_date_type",
+            "date",
+            "type",
+            postgresql_where=is_deleted.is_(False),
+            sqlite_where=is_deleted.is_(False),
+        ),
+        # Category breakdowns filter on type and group by category; PG can SUM straight from the index.
+        Index(
+            "ix_tx_live_type_category",
+            "type",
+            "category",
+            postgresql_include=["amount_pkr"],
+            postgresql_where=is_deleted.is_(False),
+            sqlite_where=is_deleted.is_(False),
+        ),
+        Index(
+            "ix_tx_live_employee_date",
+            "employee_id",
+            "date",
+            postgresql_where=is_deleted.is_(False),
+            sqlite_where=is_deleted.is_(False),
+        ),
+    )
+
     def __repr__(self) -> str:
         return f"<Transaction id={self.id} type={self.type} date={self.date} amount_pkr={self.amount_pkr}>"
 
@@ -371,3 +404,11 @@ class StockMovement(Base):
     notes = Column(Text, nullable=True)
 
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class Revision(Base):
+    __tablename__ = "revisions"
+
+    # One counter per table whose writes should invalidate cached pages (ETags, rendered reports).
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
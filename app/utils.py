@@ -18,6 +18,10 @@ OUTGOING_CATEGORIES = [
     "Kharcha",
     "Zaati Kharcha",
 ]
+ALL_CATEGORIES = sorted(set(INCOMING_CATEGORIES + OUTGOING_CATEGORIES))
+TX_TYPES = frozenset({"incoming", "outgoing"})
+INCOMING_CATEGORY_SET = frozenset(INCOMING_CATEGORIES)
+OUTGOING_CATEGORY_SET = frozenset(OUTGOING_CATEGORIES)
 
 EMPLOYEE_CATEGORIES = [
     "Factory Worker (Karkhanay Wala)",
@@ -35,6 +39,10 @@ EMPLOYEE_WORK_TYPES = [
     "per_item",
     "contract",
 ]
+EMPLOYEE_CATEGORY_SET = frozenset(EMPLOYEE_CATEGORIES)
+EMPLOYEE_WORK_TYPE_SET = frozenset(EMPLOYEE_WORK_TYPES)
+EMPLOYEE_STATUSES = frozenset({"active", "inactive"})
+ASSIGNMENT_STATUSES = frozenset({"pending", "in_progress", "completed"})
 
 EMPLOYEE_TX_TYPES = [
     "salary",
@@ -54,10 +62,17 @@ PAYMENT_METHODS = [
 def parse_date(value: str | None) -> dt.date | None:
     if not value:
         return None
-    return dt.date.fromisoformat(value)
+    # fromisoformat is already C-implemented; a malformed query string falls back like an empty one instead of a 500.
+    try:
+        return dt.date.fromisoformat(value)
+    except ValueError:
+        return None
 
 
 def pkr_format(amount_pkr: int) -> str:
+    # Amounts are Integer columns; formatting them directly skips the int -> float round trip of ",.0f".
+    if type(amount_pkr) is int:
+        return f"PKR {amount_pkr:,}"
     return f"PKR {amount_pkr:,.0f}"
 
 
@@ -75,6 +90,44 @@ def sat_thu_week_range(anchor: dt.date) -> WeekRange:
     return WeekRange(start=start, end=end)
 
 
+@dataclass(frozen=True)
+class ChartSeries:
+    labels: list[str]
+    incoming: list[int]
+    outgoing: list[int]
+    cumulative_net: list[int]
+    total_incoming: int
+    total_outgoing: int
+
+
+def build_series(days: list[tuple[dt.date, int, int]], *, window: int | None = None) -> ChartSeries:
+    # `days` is (date, incoming, outgoing) sorted by date, as returned by crud.daily_totals.
+    # With `window`, only the last `window` days get series entries; earlier days still count
+    # towards the totals and seed the cumulative net.
+    head = days[:-window] if window else ()
+    labels: list[str] = []
+    incoming: list[int] = []
+    outgoing: list[int] = []
+    cumulative_net: list[int] = []
+    total_incoming = sum(inc for _, inc, _ in head)
+    total_outgoing = sum(out for _, _, out in head)
+    for d, inc, out in days[len(head):]:
+        total_incoming += inc
+        total_outgoing += out
+        labels.append(d.isoformat())
+        incoming.append(inc)
+        outgoing.append(out)
+        cumulative_net.append(total_incoming - total_outgoing)
+    return ChartSeries(
+        labels=labels,
+        incoming=incoming,
+        outgoing=outgoing,
+        cumulative_net=cumulative_net,
+        total_incoming=total_incoming,
+        total_outgoing=total_outgoing,
+    )
+
+
 def clamp_date_range(from_date: dt.date | None, to_date: dt.date | None) -> tuple[dt.date | None, dt.date | None]:
     if from_date and to_date and from_date > to_date:
         return to_date, from_date